@@ -1,11 +1,11 @@
 # streamlit_app.py
+import io
 import math
 from datetime import date
-from dateutil.relativedelta import relativedelta
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import streamlit as st
 
@@ -24,12 +24,15 @@ CURRENCY_MAP = {
     "GBP (£)": "£",
 }
 
+BALANCE_CHART_POINTS = 120
+
 def fmt_money(x, symbol="₹"):
     try:
         return f"{symbol}{x:,.2f}"
     except Exception:
         return f"{symbol}{x}"
 
+@lru_cache(maxsize=4096)
 def compute_emi(principal: float, annual_rate_pct: float, months: int) -> float:
     """Standard amortized EMI. If rate==0, spread principal evenly."""
     if months <= 0:
@@ -37,8 +40,17 @@ def compute_emi(principal: float, annual_rate_pct: float, months: int) -> float:
     r = annual_rate_pct / 12 / 100
     if r == 0:
         return principal / months
-    return principal * r * (1 + r) ** months / ((1 + r) ** months - 1)
+    # P*r / (1 - (1+r)^-n), with the denominator as -expm1(-n*log1p(r)) so it stays exact for tiny r
+    return principal * r / -math.expm1(-months * math.log1p(r))
+
+def month_dates(start: date, n: int) -> pd.DatetimeIndex:
+    """`start` shifted by 0..n-1 months; days past a month's end clip to its last day."""
+    months = np.datetime64(start, "M") + np.arange(n)
+    first = months.astype("datetime64[D]")
+    month_len = ((months + 1).astype("datetime64[D]") - first).astype(np.int64)
+    return pd.DatetimeIndex(first + np.minimum(start.day, month_len) - 1)
 
+@st.cache_data(show_spinner=False)
 def amortization_schedule(
     principal: float,
     annual_rate_pct: float,
@@ -46,65 +58,190 @@ def amortization_schedule(
     start: date,
     extra_payment: float = 0.0,
 ):
-    """Return schedule dataframe (month-by-month). Stops early if loan is fully repaid."""
+    """Return (schedule dataframe, total interest, total paid). Stops early if loan is fully repaid.
+
+    The schedule is computed in closed form: with a constant monthly payment
+    ``pay = emi + extra_payment`` the opening balance of month m is
+    ``P*(1+r)^(m-1) - pay*((1+r)^(m-1) - 1)/r``, so every column is a numpy array op.
+    """
     r = annual_rate_pct / 12 / 100
     emi = compute_emi(principal, annual_rate_pct, months)
-    balance = principal
-    rows = []
-    m = 0
-
-    while balance > 0 and m < months + 600:  # hard cap to avoid infinite loop
-        m += 1
-        curr_date = start + relativedelta(months=+ (m - 1))
+    pay = emi + extra_payment
+    tol = 0.01  # balances at or below this count as repaid
+
+    # Number of installments until the balance first drops to <= tol. The balance falls
+    # every month once pay > principal*r (always true for months > 0), so this is exact.
+    if principal <= 0 or pay <= principal * r:
+        n = 0
+    elif principal <= tol:
+        n = 1
+    elif r == 0:
+        n = math.ceil((principal - tol) / pay)
+    else:
+        n = math.ceil(math.log((pay - tol * r) / (pay - principal * r)) / math.log1p(r))
+
+    m = np.arange(n, dtype=np.float64)
+    if r == 0:
+        opening = principal - pay * m
+        interest = np.zeros(n)
+    else:
+        growth = (1 + r) ** m
+        opening = principal * growth - pay * (growth - 1) / r
+        interest = opening * r
+    principal_component = np.minimum(pay - interest, opening)
+    closing = opening - principal_component
+    total_payment = principal_component + interest
+    if n:
+        # Ensure last row snaps to 0 precisely for neatness
+        closing[-1] = 0.0
+
+    df = pd.DataFrame({
+        "Installment #": np.arange(1, n + 1, dtype=np.int32),
+        "Date": month_dates(start, n),
+        "Opening Balance": opening,
+        "EMI (excl. extra)": np.full(n, emi),
+        "Extra Payment": np.full(n, extra_payment),
+        "Interest": interest,
+        "Principal": principal_component,
+        "Total Payment": total_payment,
+        "Closing Balance": closing,
+    })
+    return df, float(interest.sum()), float(total_payment.sum())
 
-        if r == 0:
-            interest = 0.0
-            principal_component = min(emi + extra_payment, balance)
-        else:
-            interest = balance * r
-            principal_component = min(emi + extra_payment - interest, balance)
-
-        if principal_component < 0:
-            # If extra_payment is too small (e.g., negative), guard
-            principal_component = 0.0
-
-        new_balance = balance - principal_component
-        total_payment = principal_component + interest
-
-        rows.append({
-            "Installment #": m,
-            "Date": curr_date,
-            "Opening Balance": balance,
-            "EMI (excl. extra)": emi,
-            "Extra Payment": extra_payment,
-            "Interest": interest,
-            "Principal": principal_component,
-            "Total Payment": total_payment,
-            "Closing Balance": new_balance,
-        })
-
-        balance = new_balance
-        if balance <= 0.01:
-            break
-
-    df = pd.DataFrame(rows)
-    # Ensure last row snaps to 0 precisely for neatness
-    if not df.empty:
-        df.loc[df.index[-1], "Closing Balance"] = 0.0
-    return df
+@st.cache_data(show_spinner=False)
+def schedule_csv(df: pd.DataFrame) -> bytes:
+    """UTF-8 CSV of the schedule, written straight into a bytes buffer."""
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, float_format="%.2f", encoding="utf-8")
+    return buf.getvalue()
+
+def emi_grid(principal: float, rate_list, years_list) -> np.ndarray:
+    """EMI for every (rate, tenure) pair: rows follow `rate_list`, columns `years_list`."""
+    r = np.asarray(rate_list, dtype=np.float64)[:, None] / 12 / 100
+    n = np.asarray(years_list, dtype=np.float64)[None, :] * 12
+    # Same form as compute_emi. np.where evaluates both branches, so keep r == 0 away from 0/0
+    amortized = principal * r / np.where(r == 0, 1.0, -np.expm1(-n * np.log1p(r)))
+    return np.where(r == 0, principal / n, amortized)
 
 @st.cache_data(show_spinner=False)
 def sensitivity_table(principal: float, base_rate: float, years_list, rate_list):
-    """Grid of EMI values for different rates and tenures."""
-    out = []
-    for r in rate_list:
-        row = {"Rate %": r}
-        for y in years_list:
-            months = int(y * 12)
-            row[f"{y}y"] = compute_emi(principal, r, months)
-        out.append(row)
-    df = pd.DataFrame(out)
-    return df
+    """Grid of EMI values for different rates and tenures.
+
+    Returns (df, emi_matrix, rates, years_labels) so charts can use the raw grid directly.
+    `years_list` and `rate_list` are tuples so the cache key hashes cheaply.
+    """
+    years_list = np.asarray(years_list)
+    rate_list = np.asarray(rate_list, dtype=np.float64)
+    emi_matrix = emi_grid(principal, rate_list, years_list)
+    years_labels = [f"{y}y" for y in years_list]
+    df = pd.DataFrame(emi_matrix, columns=years_labels)
+    df.insert(0, "Rate %", rate_list)
+    return df, emi_matrix, rate_list, years_labels
+
+# ------------------------ Tab renderers ------------------------
+# Each tab is a fragment, so its widgets (e.g. "Show full schedule") rerun only that tab.
+@st.fragment
+def render_charts_tab(sched: pd.DataFrame, financed_principal: float, total_interest: float, cur: str):
+    if sched.empty:
+        st.info("No schedule to display.")
+    else:
+        # plotly.express is imported on first use; only the first run in a server process pays for it
+        import plotly.express as px
+
+        # Balance over time (the curve is smooth, so thin long schedules but keep the payoff point)
+        step = max(1, len(sched) // BALANCE_CHART_POINTS)
+        bal_rows = np.unique(np.r_[0:len(sched):step, len(sched) - 1])
+        bal_fig = px.line(
+            sched.iloc[bal_rows],
+            x="Date",
+            y="Closing Balance",
+            title="Remaining Balance Over Time",
+            labels={"Closing Balance": f"Balance ({cur})"},
+        )
+        st.plotly_chart(bal_fig, use_container_width=True)
+
+        # Principal vs Interest area (monthly), stacked straight from the schedule columns
+        area_fig = go.Figure()
+        for component in ["Principal", "Interest"]:
+            area_fig.add_scatter(x=sched["Date"], y=sched[component], name=component, stackgroup="one")
+        area_fig.update_layout(
+            title="Monthly Payment Breakdown (Principal vs Interest)",
+            xaxis_title="Date",
+            yaxis_title=f"Amount ({cur})",
+            legend_title_text="Component",
+        )
+        st.plotly_chart(area_fig, use_container_width=True)
+
+        # Principal vs Interest pie (totals)
+        pie_fig = go.Figure(go.Pie(labels=["Principal", "Interest"], values=[financed_principal, total_interest]))
+        pie_fig.update_layout(title="Total Paid: Principal vs Interest")
+        st.plotly_chart(pie_fig, use_container_width=True)
+
+@st.fragment
+def render_table_tab(sched: pd.DataFrame):
+    if not sched.empty:
+        # "Date" is datetime64; show it as a plain date rather than a midnight timestamp
+        date_config = {"Date": st.column_config.DateColumn()}
+        show_all = st.checkbox("Show full schedule (may be long)")
+        if not show_all:
+            st.write("Showing first 120 rows. Tick the box above to view all.")
+            st.dataframe(sched.iloc[:120], use_container_width=True, hide_index=True, column_config=date_config)
+        else:
+            st.dataframe(sched, use_container_width=True, hide_index=True, column_config=date_config)
+
+        # CSV download
+        st.download_button(
+            "⬇️ Download amortization CSV",
+            data=schedule_csv(sched),
+            file_name="amortization_schedule.csv",
+            mime="text/csv",
+        )
+    else:
+        st.info("No table to show.")
+
+@st.fragment
+def render_sensitivity_tab(loan_amount: float, rate: float, tenure_years: int, cur: str):
+    import plotly.express as px
+
+    st.markdown("**How would EMI change if the interest rate or tenure changes?**")
+    years_list = np.arange(max(1, tenure_years - 10), tenure_years + 11, 2, dtype=np.int32)  # +/-10 years, step=2
+    rate_list = np.round(np.arange(max(0.0, rate - 5), rate + 5.1, 0.5), 1)
+    sens, emi_matrix, sens_rates, years_labels = sensitivity_table(
+        loan_amount, rate, tuple(years_list.tolist()), tuple(rate_list.tolist())
+    )
+
+    st.write("EMI Table (change in EMI for various rates & tenures):")
+    st.dataframe(sens, use_container_width=True, hide_index=True)
+
+    # Heatmap
+    heat_fig = px.imshow(
+        emi_matrix,
+        x=years_labels,
+        y=sens_rates,
+        aspect="auto",
+        title="EMI Heatmap",
+        labels={"x": "Tenure", "y": "Rate %", "color": f"EMI ({cur})"},
+    )
+    st.plotly_chart(heat_fig, use_container_width=True)
+
+    # Quick lines
+    st.markdown("**Quick Lines**")
+    # Both lines are a column/row of the grid above; only off-grid tenures/rates need computing
+    tenure_col = np.flatnonzero(years_list == tenure_years)
+    rate_row = np.flatnonzero(np.isclose(rate_list, rate))
+    line1 = pd.DataFrame({
+        "Rate %": rate_list,
+        "EMI": emi_matrix[:, tenure_col[0]] if tenure_col.size else emi_grid(loan_amount, rate_list, [tenure_years])[:, 0],
+    })
+    rate_line = px.line(line1, x="Rate %", y="EMI", title=f"EMI vs Interest Rate ({tenure_years}y)", labels={"EMI": f"EMI ({cur})"})
+    st.plotly_chart(rate_line, use_container_width=True)
+
+    line2 = pd.DataFrame({
+        "Years": years_list,
+        "EMI": emi_matrix[rate_row[0]] if rate_row.size else emi_grid(loan_amount, [rate], years_list)[0],
+    })
+    years_line = px.line(line2, x="Years", y="EMI", title=f"EMI vs Tenure (Rate {rate}%)", labels={"EMI": f"EMI ({cur})"})
+    st.plotly_chart(years_line, use_container_width=True)
 
 # ------------------------ Sidebar Inputs ------------------------
 st.sidebar.title("⚙️ Controls")
@@ -176,7 +313,7 @@ if calc:
 
     # schedule + EMI
     emi = compute_emi(financed_principal, rate, months)
-    sched = amortization_schedule(
+    sched, total_interest, total_paid = amortization_schedule(
         principal=financed_principal,
         annual_rate_pct=rate,
         months=months,
@@ -184,8 +321,6 @@ if calc:
         extra_payment=extra_monthly,
     )
 
-    total_interest = float(sched["Interest"].sum()) if not sched.empty else 0.0
-    total_paid = float(sched["Total Payment"].sum()) if not sched.empty else 0.0
     payoff_date = sched["Date"].iloc[-1] if not sched.empty else start_date
 
     # Add non-financed fees as upfront cash
@@ -230,102 +365,15 @@ if calc:
 
     # Charts
     with t1:
-        if sched.empty:
-            st.info("No schedule to display.")
-        else:
-            # Balance over time
-            bal_fig = px.line(
-                sched,
-                x="Date",
-                y="Closing Balance",
-                title="Remaining Balance Over Time",
-                labels={"Closing Balance": f"Balance ({cur})"},
-            )
-            st.plotly_chart(bal_fig, use_container_width=True)
-
-            # Principal vs Interest area (monthly)
-            area_df = sched.melt(
-                id_vars=["Date"],
-                value_vars=["Principal", "Interest"],
-                var_name="Component",
-                value_name="Amount",
-            )
-            area_fig = px.area(
-                area_df,
-                x="Date",
-                y="Amount",
-                color="Component",
-                title="Monthly Payment Breakdown (Principal vs Interest)",
-                labels={"Amount": f"Amount ({cur})"},
-            )
-            st.plotly_chart(area_fig, use_container_width=True)
-
-            # Principal vs Interest pie (totals)
-            pie_df = pd.DataFrame({
-                "Component": ["Principal", "Interest"],
-                "Amount": [financed_principal, total_interest],
-            })
-            pie_fig = px.pie(pie_df, names="Component", values="Amount", title="Total Paid: Principal vs Interest")
-            st.plotly_chart(pie_fig, use_container_width=True)
+        render_charts_tab(sched, financed_principal, total_interest, cur)
 
     # Amortization table
     with t2:
-        if not sched.empty:
-            show_all = st.checkbox("Show full schedule (may be long)")
-            if not show_all:
-                st.write("Showing first 120 rows. Tick the box above to view all.")
-                st.dataframe(sched.head(120), use_container_width=True, hide_index=True)
-            else:
-                st.dataframe(sched, use_container_width=True, hide_index=True)
-
-            # CSV download
-            csv = sched.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                "⬇️ Download amortization CSV",
-                data=csv,
-                file_name="amortization_schedule.csv",
-                mime="text/csv",
-            )
-        else:
-            st.info("No table to show.")
+        render_table_tab(sched)
 
     # Sensitivity analysis
     with t3:
-        st.markdown("**How would EMI change if the interest rate or tenure changes?**")
-        years_list = list(range(max(1, tenure_years - 10), tenure_years + 11, 2))  # +/-10 years, step=2
-        rate_list = [round(x, 1) for x in np.arange(max(0.0, rate - 5), rate + 5.1, 0.5)]
-        sens = sensitivity_table(loan_amount, rate, years_list, rate_list)
-
-        st.write("EMI Table (change in EMI for various rates & tenures):")
-        st.dataframe(sens, use_container_width=True, hide_index=True)
-
-        # Heatmap
-        heat = sens.set_index("Rate %")
-        heat_fig = px.imshow(
-            heat.values,
-            x=list(heat.columns),
-            y=list(heat.index),
-            aspect="auto",
-            title="EMI Heatmap",
-            labels={"x": "Tenure", "y": "Rate %", "color": f"EMI ({cur})"},
-        )
-        st.plotly_chart(heat_fig, use_container_width=True)
-
-        # Quick lines
-        st.markdown("**Quick Lines**")
-        line1 = pd.DataFrame({
-            "Rate %": rate_list,
-            "EMI": [compute_emi(loan_amount, r, months) for r in rate_list]
-        })
-        rate_line = px.line(line1, x="Rate %", y="EMI", title=f"EMI vs Interest Rate ({tenure_years}y)", labels={"EMI": f"EMI ({cur})"})
-        st.plotly_chart(rate_line, use_container_width=True)
-
-        line2 = pd.DataFrame({
-            "Years": years_list,
-            "EMI": [compute_emi(loan_amount, rate, y * 12) for y in years_list]
-        })
-        years_line = px.line(line2, x="Years", y="EMI", title=f"EMI vs Tenure (Rate {rate}%)", labels={"EMI": f"EMI ({cur})"})
-        st.plotly_chart(years_line, use_container_width=True)
+        render_sensitivity_tab(loan_amount, rate, tenure_years, cur)
 
     # About
     with t4: